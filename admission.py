@@ -0,0 +1,275 @@
+# admission.py - CONTRÔLE D'ADMISSION ET ÉCHÉANCES DES REQUÊTES
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+from starlette.routing import Match
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    max_concurrent: int       # requêtes traitées en parallèle par worker
+    max_queue: int            # requêtes en attente au-delà desquelles on rejette immédiatement
+    max_wait: float = 1.0     # attente maximale d'une place avant rejet (secondes)
+    deadline: float = 15.0    # durée maximale de traitement, propagée aux appels externes
+    retry_after: int = 1
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=504, detail="Le délai de traitement de la requête est dépassé.")
+
+
+class RequestCancelled(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=499, detail="La requête a été abandonnée par le client.")
+
+
+class RequestContext:
+    """Échéance et état d'annulation d'une requête, visibles depuis le thread du handler."""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+
+_current_request = ContextVar("current_request", default=None)
+
+def upstream_timeout(default: float = 10.0) -> float:
+    """Timeout à passer à un appel externe (yfinance, FMP, Gemini…) : le temps restant avant
+    l'échéance de la requête en cours, plafonné à `default`.
+
+    Lève DeadlineExceeded ou RequestCancelled si le travail n'a plus lieu d'être fait.
+    """
+    context = _current_request.get()
+    if context is None:
+        return default
+    if context.cancelled:
+        raise RequestCancelled()
+    remaining = context.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return min(default, remaining)
+
+
+class _RouteLimiter:
+    def __init__(self, limit: RouteLimit):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit.max_concurrent)
+        self.in_flight = 0
+        self.abandoned = set()  # handlers abandonnés encore en cours (références fortes)
+        self.waiting = 0
+        self.waits = deque(maxlen=1000)
+        self.stats = {"admitted": 0, "shed": 0, "cancelled": 0, "timedOut": 0}
+
+    def snapshot(self) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "maxConcurrent": self.limit.max_concurrent,
+            "maxQueue": self.limit.max_queue,
+            "deadline": self.limit.deadline,
+            "inFlight": self.in_flight,
+            "abandonedRunning": len(self.abandoned),
+            "waiting": self.waiting,
+            **self.stats,
+            "queueWaitMs": {
+                "avg": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+                "p99": round(waits[min(len(waits) - 1, math.ceil(len(waits) * 0.99) - 1)] * 1000, 2) if waits else 0.0,
+                "max": round(waits[-1] * 1000, 2) if waits else 0.0,
+            },
+        }
+
+
+class AdmissionControl:
+    """Limites par groupe de routes (préfixe de chemin) et leurs compteurs.
+
+    Les routes sans limite dédiée reçoivent chacune leur propre limiteur, construit avec la
+    limite par défaut et identifié par le chemin de la route (ex. "/api/historique/{ticker}").
+    """
+
+    def __init__(self, limits: dict, default: RouteLimit, routes: list = (), prefix: str = "/api",
+                 exempt: tuple = ()):
+        self.prefix = prefix
+        self.exempt = exempt
+        self.default = default
+        # Liste des routes de l'application (référence : les routes ajoutées plus tard sont vues)
+        self.routes = routes
+        # Les préfixes les plus longs sont testés en premier
+        self.limits = dict(sorted(limits.items(), key=lambda item: -len(item[0])))
+        self.limiters = {}
+
+    def applies_to(self, path: str) -> bool:
+        return path.startswith(self.prefix) and path not in self.exempt
+
+    def _route_path(self, scope) -> str:
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        # Les chemins inconnus partagent un seul limiteur : pas de limiteur par URL arbitraire
+        return partial or "unmatched"
+
+    def limiter(self, scope) -> _RouteLimiter:
+        path = scope.get("path", "")
+        group = next((route for route in self.limits if path.startswith(route)), None) or self._route_path(scope)
+        if group not in self.limiters:
+            self.limiters[group] = _RouteLimiter(self.limits.get(group, self.default))
+        return self.limiters[group]
+
+    def stats(self) -> dict:
+        return {group: limiter.snapshot() for group, limiter in self.limiters.items()}
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI : limite la concurrence par groupe de routes, rejette en 503 avec
+    Retry-After quand un groupe est saturé, applique une échéance (504) et annule le
+    traitement si le client se déconnecte."""
+
+    def __init__(self, app, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def _reject(self, send, status: int, detail: str, headers: dict = None):
+        body = json.dumps({"detail": detail}).encode()
+        raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        raw_headers += [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()]
+        await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or scope.get("method") == "OPTIONS" or not self.control.applies_to(path):
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.control.limiter(scope)
+        limit = limiter.limit
+
+        # --- ADMISSION ---
+        if limiter.waiting >= limit.max_queue:
+            limiter.stats["shed"] += 1
+            await self._reject(send, 503, "Le serveur est surchargé, veuillez réessayer.",
+                               {"Retry-After": str(limit.retry_after)})
+            return
+        queued_at = time.monotonic()
+        limiter.waiting += 1
+        try:
+            await asyncio.wait_for(limiter.semaphore.acquire(), timeout=limit.max_wait)
+        except asyncio.TimeoutError:
+            limiter.stats["shed"] += 1
+            await self._reject(send, 503, "Le serveur est surchargé, veuillez réessayer.",
+                               {"Retry-After": str(limit.retry_after)})
+            return
+        finally:
+            limiter.waiting -= 1
+        limiter.waits.append(time.monotonic() - queued_at)
+        limiter.stats["admitted"] += 1
+        limiter.in_flight += 1
+
+        context = RequestContext(time.monotonic() + limit.deadline)
+        token = _current_request.set(context)
+        abandoned_task = None
+        try:
+            abandoned_task = await self._run(scope, receive, send, limiter, context)
+        finally:
+            _current_request.reset(token)
+            if abandoned_task is None:
+                self._release(limiter)
+            else:
+                # Le client a déjà sa réponse, mais le handler occupe encore un thread :
+                # la place n'est rendue qu'à la fin réelle du traitement.
+                limiter.abandoned.add(abandoned_task)
+                abandoned_task.add_done_callback(lambda task: self._release(limiter, task))
+
+    def _release(self, limiter, abandoned_task=None):
+        if abandoned_task is not None:
+            limiter.abandoned.discard(abandoned_task)
+            if not abandoned_task.cancelled():
+                abandoned_task.exception()  # la réponse est ignorée, l'erreur éventuelle aussi
+        limiter.in_flight -= 1
+        limiter.semaphore.release()
+
+    async def _run(self, scope, receive, send, limiter, context):
+        """Exécute la requête. Renvoie la tâche du handler si elle a été abandonnée en cours de route."""
+        # Le corps est lu en entier avant d'appeler l'application, pour pouvoir ensuite
+        # surveiller la déconnexion du client sans concurrencer la lecture du handler.
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                limiter.stats["cancelled"] += 1
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body_sent = False
+        disconnected = asyncio.Event()
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": b"".join(chunks), "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        response_started = False
+        abandoned = False
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if abandoned:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, replay_receive, tracking_send))
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            done, _ = await asyncio.wait({app_task, watcher}, timeout=max(0.0, context.remaining()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                app_task.result()
+                return
+            # Déconnexion du client ou échéance dépassée : la réponse du handler sera ignorée.
+            # La tâche n'est pas annulée (cela libérerait la tâche asyncio sans arrêter le thread
+            # du handler synchrone) : upstream_timeout() l'empêche de lancer de nouveaux appels
+            # externes et elle se termine d'elle-même, ce qui libère alors sa place.
+            abandoned = True
+            context.cancel()
+            if watcher in done:
+                limiter.stats["cancelled"] += 1
+                return app_task
+            limiter.stats["timedOut"] += 1
+            if not response_started:
+                await self._reject(send, 504, "Le délai de traitement de la requête est dépassé.")
+            return app_task
+        finally:
+            watcher.cancel()
@@ -0,0 +1,215 @@
+# analytics_pool.py - POOL DE PROCESSUS POUR LES CALCULS ANALYTIQUES LOURDS
+import os
+import sys
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# --- CONFIGURATION ---
+# Chaque worker uvicorn a son propre pool : par défaut, les cœurs sont répartis entre les
+# WEB_CONCURRENCY workers (la variable lue par uvicorn pour --workers) au lieu d'être tous
+# réclamés par chacun d'eux.
+WEB_CONCURRENCY = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+ANALYTICS_POOL_WORKERS = int(os.getenv('ANALYTICS_POOL_WORKERS', max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+ANALYTICS_POOL_QUEUE = int(os.getenv('ANALYTICS_POOL_QUEUE', ANALYTICS_POOL_WORKERS * 4))
+ANALYTICS_JOB_DEADLINE = float(os.getenv('ANALYTICS_JOB_DEADLINE', 10))
+
+
+class PoolSaturatedError(Exception):
+    """La file d'attente du pool est pleine : la requête doit être rejetée."""
+
+
+class JobDeadlineExceeded(Exception):
+    """Le calcul n'a pas terminé avant son échéance."""
+
+
+# --- FONCTIONS EXÉCUTÉES DANS LES PROCESSUS DU POOL ---
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # Avant Python 3.13, le resource_tracker enregistre aussi les blocs ouverts par les workers
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _timed_job(fn, *args):
+    """Exécute fn(*args) et renvoie (durée d'exécution dans le worker, résultat)."""
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def _correlation_job(in_name: str, out_name: str, shape: tuple, columns: list) -> list:
+    """Remplit les trous, calcule la corrélation et écrit les prix normalisés en mémoire partagée."""
+    shm_in = _attach(in_name)
+    shm_out = _attach(out_name)
+    try:
+        prices = np.ndarray(shape, dtype=np.float64, buffer=shm_in.buf)
+        frame = pd.DataFrame(prices, columns=columns, copy=True).ffill().bfill()
+        del prices
+
+        filled = frame.to_numpy()
+        normalized = np.ndarray(shape, dtype=np.float64, buffer=shm_out.buf)
+        normalized[:] = filled / filled[0] * 100
+        del normalized
+
+        return frame.corr().to_numpy().tolist()
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+
+# --- GESTION DU POOL ---
+class AnalyticsPool:
+    """Pool de processus avec file bornée, échéance par tâche et statistiques d'utilisation."""
+
+    def __init__(self, max_workers: int = ANALYTICS_POOL_WORKERS, max_pending: int = ANALYTICS_POOL_QUEUE,
+                 default_deadline: float = ANALYTICS_JOB_DEADLINE):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.default_deadline = default_deadline
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._in_flight = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timedOut": 0,
+            "busySeconds": 0.0,
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # "spawn" évite de forker un serveur qui a déjà des threads actifs
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _record(self, key: str, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def run(self, fn, *args, deadline: float = None, on_done=None):
+        """Exécute fn(*args) dans le pool et attend le résultat au plus `deadline` secondes.
+
+        `on_done` est appelé une fois le worker réellement terminé (même après une échéance
+        dépassée), ce qui permet de libérer les ressources partagées au bon moment.
+        """
+        if not self._slots.acquire(blocking=False):
+            self._record("rejected")
+            if on_done:
+                on_done()
+            raise PoolSaturatedError("Le pool de calcul est saturé.")
+
+        with self._lock:
+            self._in_flight += 1
+            self._stats["submitted"] += 1
+
+        def _release(future=None):
+            with self._lock:
+                self._in_flight -= 1
+                if future is not None and not future.cancelled() and future.exception() is None:
+                    # Seul le temps passé à calculer dans le worker compte (ni file d'attente, ni démarrage)
+                    self._stats["busySeconds"] += future.result()[0]
+                    self._stats["completed"] += 1
+                else:
+                    self._stats["failed"] += 1
+            self._slots.release()
+            if on_done:
+                on_done()
+
+        try:
+            future = self._get_executor().submit(_timed_job, fn, *args)
+        except BrokenProcessPool:
+            self._reset_executor()
+            _release()
+            raise
+        except Exception:
+            _release()
+            raise
+        future.add_done_callback(_release)
+
+        try:
+            return future.result(timeout=deadline if deadline is not None else self.default_deadline)[1]
+        except FutureTimeoutError:
+            future.cancel()
+            self._record("timedOut")
+            raise JobDeadlineExceeded("Le calcul a dépassé son échéance.")
+        except BrokenProcessPool:
+            self._reset_executor()
+            raise
+
+    def correlation(self, prices: pd.DataFrame, deadline: float = None):
+        """Calcule la matrice de corrélation et les prix normalisés (base 100) dans le pool.
+
+        La matrice de prix transite par un bloc de mémoire partagée au lieu d'être sérialisée.
+        """
+        values = np.ascontiguousarray(prices.to_numpy(dtype=np.float64))
+        columns = [str(col) for col in prices.columns]
+        size = max(values.nbytes, 1)
+        shm_in = shared_memory.SharedMemory(create=True, size=size)
+        shm_out = shared_memory.SharedMemory(create=True, size=size)
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm_in.buf)[:] = values
+
+        # Les blocs ne sont libérés qu'une fois le worker ET le lecteur terminés
+        pending_owners = [2]
+        owners_lock = threading.Lock()
+
+        def _free_blocks():
+            with owners_lock:
+                pending_owners[0] -= 1
+                if pending_owners[0]:
+                    return
+            for shm in (shm_in, shm_out):
+                shm.close()
+                shm.unlink()
+
+        try:
+            corr_values = self.run(_correlation_job, shm_in.name, shm_out.name, values.shape, columns,
+                                   deadline=deadline, on_done=_free_blocks)
+            view = np.ndarray(values.shape, dtype=np.float64, buffer=shm_out.buf)
+            normalized_values = view.copy()
+            del view
+        finally:
+            _free_blocks()
+
+        correlation_matrix = pd.DataFrame(corr_values, index=columns, columns=columns)
+        normalized = pd.DataFrame(normalized_values, index=prices.index, columns=columns)
+        return correlation_matrix, normalized
+
+    def stats(self) -> dict:
+        with self._lock:
+            uptime = time.monotonic() - self._started_at
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+        return {
+            "workers": self.max_workers,
+            "queueCapacity": self.max_pending,
+            "inFlight": in_flight,
+            "running": min(in_flight, self.max_workers),
+            "queued": max(0, in_flight - self.max_workers),
+            **stats,
+            "busySeconds": round(stats["busySeconds"], 3),
+            "utilization": round(stats["busySeconds"] / (uptime * self.max_workers), 4) if uptime > 0 else 0.0,
+        }
+
+    def shutdown(self):
+        self._reset_executor()
@@ -0,0 +1,213 @@
+# cache_store.py - CACHE PARTAGÉ ENTRE WORKERS, PERSISTÉ SUR DISQUE (SQLite)
+import os
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- CONFIGURATION ---
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'finanalyse_cache.db'))
+CACHE_MEMORY_ITEMS = int(os.getenv('CACHE_MEMORY_ITEMS', 2000))
+CACHE_MMAP_BYTES = int(os.getenv('CACHE_MMAP_BYTES', 256 * 1024 * 1024))
+CACHE_WARM_ITEMS = int(os.getenv('CACHE_WARM_ITEMS', 200))
+
+# Les compteurs de lectures sont regroupés pour ne pas écrire dans la base à chaque accès
+HITS_FLUSH_INTERVAL = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS cache_hits ON cache (namespace, hits DESC);
+"""
+
+_MISSING = object()
+
+
+# --- CONNEXIONS ---
+def thread_connection(local: threading.local, path: str) -> sqlite3.Connection:
+    """Connexion du thread courant à la base partagée.
+
+    Le cache, le registre des dividendes et l'index des actualités ouvrent le même fichier :
+    ils passent tous par ici pour garder les mêmes réglages (WAL, synchronous, mmap).
+    """
+    # Une connexion par thread : sqlite3 ne partage pas ses connexions entre threads
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={CACHE_MMAP_BYTES}")
+        local.conn = conn
+    return conn
+
+
+def close_thread_connection(local: threading.local):
+    conn = getattr(local, "conn", None)
+    if conn is not None:
+        conn.close()
+        local.conn = None
+
+
+class CacheStore:
+    """Cache à deux niveaux : un LRU en mémoire par processus, adossé à une base SQLite
+    (mode WAL, mémoire mappée) partagée par tous les workers uvicorn."""
+
+    def __init__(self, path: str = CACHE_DB_PATH, memory_items: int = CACHE_MEMORY_ITEMS):
+        self.path = path
+        self.memory_items = memory_items
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # (namespace, key) -> (expires_at, value)
+        self._pending_hits = {}
+        self._last_flush = time.monotonic()
+        self._stats = {
+            "memoryHits": 0,
+            "diskHits": 0,
+            "misses": 0,
+            "writes": 0,
+            "warmupSeconds": None,
+            "warmupItems": 0,
+        }
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path)
+
+    # --- NIVEAU MÉMOIRE ---
+    def _remember(self, entry_key: tuple, expires_at: float, value):
+        with self._lock:
+            self._memory[entry_key] = (expires_at, value)
+            self._memory.move_to_end(entry_key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _count_hit(self, entry_key: tuple, source: str):
+        with self._lock:
+            self._stats[source] += 1
+            self._pending_hits[entry_key] = self._pending_hits.get(entry_key, 0) + 1
+            due = time.monotonic() - self._last_flush >= HITS_FLUSH_INTERVAL
+        if due:
+            self.flush_hits()
+
+    def flush_hits(self):
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self._connection().executemany(
+                "UPDATE cache SET hits = hits + ? WHERE namespace = ? AND key = ?",
+                [(count, namespace, key) for (namespace, key), count in pending.items()],
+            )
+        except sqlite3.Error as e:
+            print(f"Erreur cache (compteurs): {e}")
+
+    # --- API PUBLIQUE ---
+    def get(self, namespace: str, key: str, default=None, shared_only: bool = False):
+        """Lit une entrée. `shared_only` ignore le niveau mémoire de ce processus, pour les
+        valeurs que d'autres workers peuvent avoir modifiées entre-temps."""
+        entry_key = (namespace, key)
+        now = time.time()
+        with self._lock:
+            cached = None if shared_only else self._memory.get(entry_key)
+            if cached is not None:
+                if cached[0] > now:
+                    self._memory.move_to_end(entry_key)
+                else:
+                    del self._memory[entry_key]
+                    cached = None
+        if cached is not None:
+            self._count_hit(entry_key, "memoryHits")
+            return cached[1]
+
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, now),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Erreur cache (lecture): {e}")
+            row = None
+        if row is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return default
+
+        value = json.loads(row[0])
+        if not shared_only:
+            self._remember(entry_key, row[1], value)
+        self._count_hit(entry_key, "diskHits")
+        return value
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        now = time.time()
+        expires_at = now + ttl
+        self._remember((namespace, key), expires_at, value)
+        try:
+            self._connection().execute(
+                "INSERT INTO cache (namespace, key, value, updated_at, expires_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, "
+                "updated_at = excluded.updated_at, expires_at = excluded.expires_at",
+                (namespace, key, json.dumps(value, default=str), now, expires_at),
+            )
+            with self._lock:
+                self._stats["writes"] += 1
+        except sqlite3.Error as e:
+            print(f"Erreur cache (écriture): {e}")
+
+    def get_or_fetch(self, namespace: str, key: str, ttl: float, fetch):
+        """Renvoie la valeur en cache, ou appelle fetch() et mémorise son résultat."""
+        value = self.get(namespace, key, _MISSING)
+        if value is _MISSING:
+            value = fetch()
+            self.set(namespace, key, value, ttl)
+        return value
+
+    def warm_start(self, namespaces: list, limit: int = CACHE_WARM_ITEMS):
+        """Charge en mémoire les entrées les plus consultées de chaque espace de noms."""
+        started = time.perf_counter()
+        loaded = 0
+        now = time.time()
+        conn = self._connection()
+        for namespace in namespaces:
+            rows = conn.execute(
+                "SELECT key, value, expires_at FROM cache WHERE namespace = ? AND expires_at > ? "
+                "ORDER BY hits DESC LIMIT ?",
+                (namespace, now, limit),
+            ).fetchall()
+            for key, value, expires_at in rows:
+                self._remember((namespace, key), expires_at, json.loads(value))
+                loaded += 1
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["warmupSeconds"] = round(elapsed, 4)
+            self._stats["warmupItems"] = loaded
+        return loaded
+
+    def purge_expired(self):
+        try:
+            self._connection().execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            print(f"Erreur cache (purge): {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memoryItems"] = len(self._memory)
+        lookups = stats["memoryHits"] + stats["diskHits"] + stats["misses"]
+        stats["hitRate"] = round((stats["memoryHits"] + stats["diskHits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def close(self):
+        self.flush_hits()
+        close_thread_connection(self._local)
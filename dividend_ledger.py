@@ -0,0 +1,177 @@
+# dividend_ledger.py - REGISTRE LOCAL DES DIVIDENDES ET ANALYSES MULTI-TICKERS
+import contextvars
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from cache_store import CACHE_DB_PATH, close_thread_connection, thread_connection
+
+# Un ticker n'est resynchronisé avec la source qu'après ce délai
+LEDGER_SYNC_TTL = 12 * 60 * 60
+LEDGER_SYNC_THREADS = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dividend_events (
+    ticker TEXT NOT NULL,
+    ex_date TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (ticker, ex_date)
+);
+CREATE TABLE IF NOT EXISTS dividend_tickers (
+    ticker TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL,
+    price REAL,
+    dividend_rate REAL,
+    payout_ratio REAL
+);
+"""
+
+
+class DividendLedger:
+    """Stocke les versements de dividendes de chaque ticker et ne les resynchronise
+    avec la source qu'une fois leur durée de validité écoulée."""
+
+    def __init__(self, path: str = CACHE_DB_PATH, sync_ttl: float = LEDGER_SYNC_TTL):
+        self.path = path
+        self.sync_ttl = sync_ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path)
+
+    def _synced_at(self, tickers: list) -> dict:
+        placeholders = ",".join("?" * len(tickers))
+        rows = self._connection().execute(
+            f"SELECT ticker, synced_at FROM dividend_tickers WHERE ticker IN ({placeholders})",
+            tickers,
+        ).fetchall()
+        return dict(rows)
+
+    def sync(self, ticker: str, loader):
+        """Remplace les versements du ticker par la série renvoyée par loader(ticker).
+
+        loader renvoie (série de dividendes indexée par date, dict info du ticker). La série
+        entière est réécrite : yfinance ajuste les montants passés après une division
+        d'actions, et le registre ne doit pas mélanger montants ajustés et non ajustés.
+        """
+        dividends, info = loader(ticker)
+        events = []
+        if dividends is not None and not dividends.empty:
+            ex_dates = pd.DatetimeIndex(dividends.index).strftime("%Y-%m-%d")
+            events = [(ticker, ex_date, float(amount)) for ex_date, amount in zip(ex_dates, dividends.to_numpy())]
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM dividend_events WHERE ticker = ?", (ticker,))
+            conn.executemany("INSERT OR REPLACE INTO dividend_events (ticker, ex_date, amount) VALUES (?, ?, ?)", events)
+            conn.execute(
+                "INSERT OR REPLACE INTO dividend_tickers (ticker, synced_at, price, dividend_rate, payout_ratio) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (ticker, time.time(), info.get("currentPrice") or info.get("previousClose"),
+                 info.get("dividendRate"), info.get("payoutRatio")),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(events)
+
+    def ensure(self, tickers: list, loader) -> dict:
+        """Synchronise en parallèle les tickers absents ou périmés. Renvoie les erreurs par ticker."""
+        synced_at = self._synced_at(tickers)
+        now = time.time()
+        stale = [t for t in tickers if t not in synced_at or now - synced_at[t] > self.sync_ttl]
+        errors = {}
+        if not stale:
+            return errors
+
+        def _sync(ticker):
+            try:
+                self.sync(ticker, loader)
+            except Exception as e:
+                errors[ticker] = e
+
+        # Chaque synchronisation hérite du contexte de la requête (échéance, annulation)
+        contexts = [contextvars.copy_context() for _ in stale]
+        with ThreadPoolExecutor(max_workers=min(LEDGER_SYNC_THREADS, len(stale))) as executor:
+            list(executor.map(lambda context, ticker: context.run(_sync, ticker), contexts, stale))
+        return errors
+
+    def load(self, tickers: list):
+        """Renvoie (événements, métadonnées) des tickers demandés sous forme de DataFrames."""
+        placeholders = ",".join("?" * len(tickers))
+        conn = self._connection()
+        events = pd.read_sql_query(
+            f"SELECT ticker, ex_date, amount FROM dividend_events WHERE ticker IN ({placeholders})",
+            conn, params=tickers, parse_dates=["ex_date"],
+        )
+        meta = pd.read_sql_query(
+            f"SELECT ticker, price, dividend_rate, payout_ratio FROM dividend_tickers WHERE ticker IN ({placeholders})",
+            conn, params=tickers, index_col="ticker",
+        )
+        return events, meta
+
+    def close(self):
+        close_thread_connection(self._local)
+
+
+# --- ANALYSES VECTORISÉES ---
+def dividend_analytics(events: pd.DataFrame, meta: pd.DataFrame, tickers: list, years: int = 5,
+                       today: date = None) -> dict:
+    """Totaux annuels, CAGR, séries de hausses consécutives et rendement glissant (12 mois),
+    calculés pour tous les tickers à la fois par regroupements."""
+    today = pd.Timestamp(today or date.today())
+    last_full_year = today.year - 1
+    history_years = list(range(today.year - years + 1, today.year + 1))
+
+    events = events.assign(year=events["ex_date"].dt.year)
+    annual = events.groupby(["ticker", "year"])["amount"].sum().unstack("year")
+    first_year = min(int(events["year"].min()) if not events.empty else today.year, last_full_year - years)
+    annual = annual.reindex(index=tickers, columns=range(first_year, today.year + 1)).fillna(0.0)
+
+    # CAGR sur `years` années complètes
+    start, end = annual[last_full_year - years], annual[last_full_year]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cagr = (end / start) ** (1 / years) - 1
+    cagr = cagr.where((start > 0) & (end > 0))
+
+    # Nombre d'années complètes consécutives de hausse, en remontant depuis la dernière.
+    # Les années avant le premier versement, et cette première année souvent partielle, sont
+    # ignorées : la série ne dépend que de l'historique propre au ticker, pas du lot demandé.
+    full_years = annual.loc[:, :last_full_year]
+    first_paid = events.groupby("ticker")["year"].min().reindex(tickers)
+    paying = full_years.columns.to_numpy()[None, :] > first_paid.to_numpy()[:, None]
+    increases = (full_years.where(paying).diff(axis=1).iloc[:, 1:] > 0).astype(int)
+    streak = increases.iloc[:, ::-1].cumprod(axis=1).sum(axis=1)
+
+    trailing = events[events["ex_date"] > today - pd.DateOffset(years=1)]
+    ttm = trailing.groupby("ticker")["amount"].sum().reindex(tickers).fillna(0.0)
+    meta = meta.reindex(tickers)
+    trailing_yield = (ttm / meta["price"]).where(meta["price"] > 0)
+
+    def _clean(value):
+        return None if pd.isna(value) else float(value)
+
+    history = annual[history_years]
+    return {
+        ticker: {
+            "dividendRate": _clean(meta.at[ticker, "dividend_rate"]),
+            "payoutRatio": _clean(meta.at[ticker, "payout_ratio"]),
+            "dividendHistory": {
+                "years": history_years,
+                "amounts": history.loc[ticker].tolist(),
+            },
+            "trailingAnnualDividend": float(ttm[ticker]),
+            "trailingYield": _clean(trailing_yield[ticker]),
+            "dividendCagr": _clean(cagr[ticker]),
+            "growthStreak": int(streak[ticker]),
+        }
+        for ticker in tickers
+    }
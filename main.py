@@ -171,6 +171,11 @@ import requests
 from pydantic import BaseModel
 import pandas as pd 
 from datetime import datetime, timedelta
+from analytics_pool import AnalyticsPool, PoolSaturatedError, JobDeadlineExceeded
+from cache_store import CacheStore
+from dividend_ledger import DividendLedger, dividend_analytics
+from news_index import NewsIndex
+from admission import AdmissionControl, AdmissionMiddleware, RouteLimit, upstream_timeout
 
 # --- CONFIGURATION SÉCURISÉE DES CLÉS API ---
 # Charge les variables depuis le fichier .env (pour le local) ou l'environnement (pour Render)
@@ -195,6 +200,29 @@ else:
 # --- INITIALISATION DE L'APPLICATION FASTAPI ---
 app = FastAPI()
 
+# --- CONTRÔLE D'ADMISSION (limites par worker, échéances propagées aux appels externes) ---
+# Les routes non listées ont chacune leur propre limite, avec les valeurs par défaut
+# Ajouté avant CORS pour que les réponses 503/504 portent aussi les en-têtes CORS
+admission = AdmissionControl(
+    limits={
+        "/api/chat": RouteLimit(max_concurrent=8, max_queue=16, max_wait=2.0, deadline=30.0),
+        "/api/correlation": RouteLimit(max_concurrent=4, max_queue=8, max_wait=2.0, deadline=20.0),
+        "/api/screener": RouteLimit(max_concurrent=2, max_queue=4, max_wait=2.0, deadline=30.0, retry_after=5),
+        "/api/dividends": RouteLimit(max_concurrent=8, max_queue=16, max_wait=1.0, deadline=20.0),
+        "/api/entreprise": RouteLimit(max_concurrent=16, max_queue=32, max_wait=1.0, deadline=15.0),
+        "/api/news": RouteLimit(max_concurrent=16, max_queue=64, max_wait=0.5, deadline=10.0),
+    },
+    default=RouteLimit(max_concurrent=16, max_queue=32, max_wait=1.0, deadline=15.0),
+    routes=app.routes,
+    exempt=("/api/admission/stats",),
+)
+app.add_middleware(AdmissionMiddleware, control=admission)
+
+@app.get("/api/admission/stats")
+def get_admission_stats():
+    """Temps d'attente en file, rejets et annulations par groupe de routes (pour ce worker)."""
+    return admission.stats()
+
 # --- CONFIGURATION CORS ---
 origins = [
     "https://finanalyses.pages.dev",
@@ -211,20 +239,114 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- MODÈLES DE DONNÉES ET STOCKAGE POUR LE CHAT ---
+# --- MODÈLES DE DONNÉES POUR LE CHAT ---
+# L'historique des sessions est stocké dans le cache partagé (voir get_chat_session)
 class ChatMessage(BaseModel):
     session_id: str
     message: str
 
-chat_sessions = {}
+# --- POOL DE PROCESSUS POUR LES CALCULS LOURDS (corrélation) ---
+analytics_pool = AnalyticsPool()
+
+@app.on_event("shutdown")
+def shutdown_analytics_pool():
+    analytics_pool.shutdown()
+
+# --- CACHE PARTAGÉ ENTRE WORKERS ET PERSISTÉ ENTRE LES REDÉMARRAGES ---
+cache = CacheStore()
+CACHE_TTL = {
+    "info": 15 * 60,           # stock.info d'un ticker
+    "history": 60 * 60,        # historique de prix
+    "ai_comment": 6 * 60 * 60, # commentaires d'analyse générés par l'IA
+    "chat": 24 * 60 * 60,      # historique des sessions de chat
+}
+
+@app.on_event("startup")
+def warm_up_cache():
+    cache.purge_expired()
+    # Les historiques de chat sont toujours relus sur disque : inutile de les précharger.
+    # Aucune route servie ne produit de commentaire IA : rien à précharger non plus.
+    loaded = cache.warm_start(["info", "history"])
+    print(f"INFO: Cache préchauffé avec {loaded} entrées en {cache.stats()['warmupSeconds']} s.")
+
+@app.on_event("shutdown")
+def close_cache():
+    cache.close()
+
+# --- REGISTRE DES DIVIDENDES (stocké dans la même base que le cache) ---
+dividend_ledger = DividendLedger(cache.path)
+MAX_DIVIDEND_TICKERS = 50
+
+@app.on_event("shutdown")
+def close_dividend_ledger():
+    dividend_ledger.close()
+
+# --- INDEX LOCAL DES ACTUALITÉS (alimenté en tâche de fond depuis Marketaux) ---
+news_index = NewsIndex(MARKETAUX_API_KEY, cache.path)
+
+@app.on_event("startup")
+def start_news_ingestion():
+    news_index.start()
+
+@app.on_event("shutdown")
+def stop_news_ingestion():
+    news_index.close()
+
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    """Taux de succès du cache et durée du préchauffage de ce worker."""
+    return cache.stats()
 
 # --- FONCTIONS HELPER ---
 def get_stock_data(ticker: str):
     stock = yf.Ticker(ticker.upper())
-    if stock.history(period="1d").empty:
+    if stock.history(period="1d", timeout=upstream_timeout()).empty:
         raise HTTPException(status_code=404, detail=f"Symbole '{ticker}' non trouvé ou sans données.")
     return stock
 
+def get_ticker_info(ticker: str) -> dict:
+    """Renvoie stock.info depuis le cache partagé, ou le récupère auprès de yfinance."""
+    return cache.get_or_fetch("info", ticker.upper(), CACHE_TTL["info"], lambda: get_stock_data(ticker).info)
+
+def get_price_history(ticker: str, period: str = "1y") -> dict:
+    """Renvoie l'historique des cours de clôture depuis le cache partagé."""
+    def fetch():
+        hist = get_stock_data(ticker).history(period=period, timeout=upstream_timeout())
+        return {
+            "dates": hist.index.strftime("%Y-%m-%d").tolist(),
+            "prices": hist["Close"].fillna(0).tolist(),
+        }
+    return cache.get_or_fetch("history", f"{ticker.upper()}:{period}", CACHE_TTL["history"], fetch)
+
+def load_dividends(ticker: str):
+    """Source du registre des dividendes : versements yfinance et stock.info (via le cache)."""
+    stock = get_stock_data(ticker)
+    info = cache.get_or_fetch("info", ticker.upper(), CACHE_TTL["info"], lambda: stock.info)
+    return stock.dividends, info
+
+def get_dividend_summaries(tickers: list) -> tuple:
+    """Synchronise le registre si nécessaire puis calcule les analyses de dividendes de tous les tickers."""
+    errors = dividend_ledger.ensure(tickers, load_dividends)
+    valid_tickers = [ticker for ticker in tickers if ticker not in errors]
+    summaries = {}
+    if valid_tickers:
+        events, meta = dividend_ledger.load(valid_tickers)
+        summaries = dividend_analytics(events, meta, valid_tickers)
+    return summaries, errors
+
+def get_chat_session(session_id: str, initial_history: list):
+    """Reconstruit la session de chat à chaque message depuis l'historique partagé, pour que
+    tous les workers (et un worker redémarré) continuent la même conversation."""
+    history = cache.get("chat", session_id, shared_only=True) or initial_history
+    return model.start_chat(history=history)
+
+def save_chat_session(session_id: str, chat_session):
+    history = [
+        {"role": content.role, "parts": [part.text for part in content.parts]}
+        for content in chat_session.history
+    ]
+    cache.set("chat", session_id, history, CACHE_TTL["chat"])
+
 def generate_ai_analysis_comment(data: dict) -> str:
     if not model:
         return "Le service d'analyse par IA est désactivé car la clé API n'est pas configurée."
@@ -241,7 +363,7 @@ def generate_ai_analysis_comment(data: dict) -> str:
         - Marge nette : {data.get('netMargin', 0) * 100:.1f}%
         Basé sur ces données, mentionne un point fort et un point de vigilance. Conclus par une phrase neutre. Ne donne pas de conseil d'investissement.
         """
-        response = model.generate_content(prompt)
+        response = model.generate_content(prompt, request_options={"timeout": upstream_timeout(30)})
         return response.text.strip()
     except Exception as e:
         print(f"Erreur lors de la génération par l'IA: {e}")
@@ -250,19 +372,29 @@ def generate_ai_analysis_comment(data: dict) -> str:
 # --- POINTS D'ACCÈS DE L'API (ROUTES) ---
 
 @app.get("/api/news")
-def get_real_time_news():
+def get_real_time_news(
+    ticker: str = None,
+    source: str = None,
+    q: str = None,
+    published_after: str = None,
+    page: int = Query(1, ge=1),
+    limit: int = Query(15, ge=1, le=100),
+):
+    """Actualités filtrées (ticker, source, mots-clés) et paginées, servies depuis l'index local."""
     if not MARKETAUX_API_KEY:
         raise HTTPException(status_code=500, detail="La clé API pour les actualités n'est pas configurée.")
-    
-    url = f"https://api.marketaux.com/v1/news/all?countries=us,fr&filter_entities=true&limit=15&language=en&api_token={MARKETAUX_API_KEY}"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        return {"articles": data.get("data", [])}
-    except requests.exceptions.RequestException as e:
-        print(f"Erreur API Marketaux: {e}")
+
+    # Premier démarrage : l'index est vide, on l'alimente avant de répondre (une seule fois)
+    news_index.fill_once()
+    if news_index.last_error and news_index.is_empty():
         raise HTTPException(status_code=503, detail="Le service d'actualités est temporairement indisponible.")
+    return news_index.search(ticker=ticker, source=source, keywords=q,
+                             published_after=published_after, page=page, limit=limit)
+
+@app.get("/api/news/stats")
+def get_news_stats():
+    """État de l'ingestion des actualités (curseur, doublons écartés, nombre d'articles)."""
+    return news_index.stats()
 
 
 
@@ -271,8 +403,7 @@ def get_real_time_news():
 @app.get("/api/entreprise/{ticker}")
 def get_financial_data(ticker: str):
     try:
-        stock = get_stock_data(ticker)
-        info = stock.info
+        info = get_ticker_info(ticker)
         
         financial_data = {
             "name": info.get("longName", ticker.upper()),
@@ -291,18 +422,17 @@ def get_financial_data(ticker: str):
         
         return financial_data
         
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/api/historique/{ticker}")
 def get_historical_data(ticker: str):
     try:
-        stock = get_stock_data(ticker)
-        hist = stock.history(period="1y")
-        return {
-            "dates": hist.index.strftime("%Y-%m-%d").tolist(),
-            "prices": hist["Close"].fillna(0).tolist(),
-        }
+        return get_price_history(ticker)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -328,26 +458,20 @@ def get_advanced_metrics(ticker: str):
             "freeCashFlow": free_cashflow,
             "dividendYield": info.get('dividendYield'),
         }
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/dividends/{ticker}")
 def get_dividend_data(ticker: str):
     try:
-        stock = get_stock_data(ticker)
-        dividends = stock.dividends.last('5YE')
-        annual_dividends = {}
-        if not dividends.empty:
-            annual_dividends = dividends.resample('YE').sum().to_dict()
-        
-        return {
-            "dividendRate": stock.info.get("dividendRate"),
-            "payoutRatio": stock.info.get("payoutRatio"),
-            "dividendHistory": {
-                "years": [d.year for d in annual_dividends.keys()],
-                "amounts": list(annual_dividends.values())
-            }
-        }
+        summaries, errors = get_dividend_summaries([ticker.upper()])
+        if errors:
+            raise next(iter(errors.values()))
+        return summaries[ticker.upper()]
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -373,7 +497,7 @@ def stock_screener(sector: str = None, pe_max: float = None, dividend_min: float
         params["dividendYield"] = dividend_min
 
     try:
-        response = requests.get(base_url, params=params)
+        response = requests.get(base_url, params=params, timeout=upstream_timeout())
         response.raise_for_status()  # Lève une exception si la requête échoue (ex: 4xx, 5xx)
         
         # Formate les résultats pour correspondre à ce que le frontend attend
@@ -397,7 +521,7 @@ def search_symbols(query: str):
     if not FMP_API_KEY: raise HTTPException(status_code=500, detail="Clé API FMP non configurée.")
     url = f"https://financialmodelingprep.com/api/v3/search?query={query}&limit=10&apikey={FMP_API_KEY}"
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=upstream_timeout())
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -408,7 +532,7 @@ def get_companies_by_country(country_code: str):
     if not FMP_API_KEY: raise HTTPException(status_code=500, detail="Clé API FMP non configurée.")
     url = f"https://financialmodelingprep.com/api/v3/stock-screener?country={country_code.upper()}&limit=20&apikey={FMP_API_KEY}"
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=upstream_timeout())
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -419,7 +543,7 @@ def get_top_gainers():
     if not FMP_API_KEY: raise HTTPException(status_code=500, detail="Clé API FMP non configurée.")
     url = f"https://financialmodelingprep.com/api/v3/stock_market/gainers?apikey={FMP_API_KEY}"
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=upstream_timeout())
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -430,7 +554,7 @@ def get_top_losers():
     if not FMP_API_KEY: raise HTTPException(status_code=500, detail="Clé API FMP non configurée.")
     url = f"https://financialmodelingprep.com/api/v3/stock_market/losers?apikey={FMP_API_KEY}"
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=upstream_timeout())
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -448,7 +572,7 @@ def get_economic_calendar():
     url = f"https://financialmodelingprep.com/api/v3/economic_calendar?from={today}&to={next_week}&apikey={FMP_API_KEY}"
     
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=upstream_timeout())
         response.raise_for_status()
         data = response.json()
         return data
@@ -465,7 +589,7 @@ def get_correlation(tickers: str = Query(..., min_length=3)):
 
     try:
         # Télécharger les données historiques sur 1 an pour tous les tickers
-        data = yf.download(ticker_list, period="1y")['Close']
+        data = yf.download(ticker_list, period="1y", timeout=upstream_timeout(20))['Close']
         if data.empty or data.isnull().all().all():
             raise HTTPException(status_code=404, detail="Impossible de récupérer les données pour les symboles fournis.")
 
@@ -474,16 +598,9 @@ def get_correlation(tickers: str = Query(..., min_length=3)):
         if len(data.columns) < 2:
             raise HTTPException(status_code=400, detail="Données valides trouvées pour moins de deux symboles.")
         
-        # Remplir les valeurs manquantes restantes
-        data.ffill(inplace=True)
-        data.bfill(inplace=True)
-
-        # Calculer la matrice de corrélation
-        correlation_matrix = data.corr()
+        # Remplissage des trous, corrélation et normalisation (base 100) dans le pool de processus
+        correlation_matrix, normalized_prices = analytics_pool.correlation(data, deadline=upstream_timeout(analytics_pool.default_deadline))
 
-        # Normaliser les prix pour la visualisation
-        normalized_prices = (data / data.iloc[0] * 100)
-        
         return {
             "correlation_matrix": correlation_matrix.to_dict(),
             "normalized_prices": {
@@ -491,9 +608,36 @@ def get_correlation(tickers: str = Query(..., min_length=3)):
                 "series": {col: normalized_prices[col].tolist() for col in normalized_prices.columns}
             }
         }
+    except PoolSaturatedError:
+        raise HTTPException(status_code=503, detail="Le service de calcul est saturé, veuillez réessayer.", headers={"Retry-After": "1"})
+    except JobDeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Le calcul de la corrélation a pris trop de temps.")
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors du calcul de la corrélation : {str(e)}")
 
+# --- NOUVEAU : ANALYSE DES DIVIDENDES DE PLUSIEURS TICKERS EN UNE REQUÊTE ---
+@app.get("/api/dividends")
+def get_dividends_bulk(tickers: str = Query(..., min_length=1)):
+    ticker_list = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers.split(',') if ticker.strip()))
+    if not ticker_list:
+        raise HTTPException(status_code=400, detail="Veuillez fournir au moins un symbole.")
+    if len(ticker_list) > MAX_DIVIDEND_TICKERS:
+        raise HTTPException(status_code=400, detail=f"Maximum {MAX_DIVIDEND_TICKERS} symboles par requête.")
+
+    try:
+        summaries, errors = get_dividend_summaries(ticker_list)
+        return {
+            "dividends": summaries,
+            "errors": {
+                ticker: e.detail if isinstance(e, HTTPException) else str(e)
+                for ticker, e in errors.items()
+            },
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur lors de l'analyse des dividendes : {str(e)}")
+
 
 @app.post("/api/chat")
 def chat_with_ai(chat_message: ChatMessage):
@@ -503,14 +647,14 @@ def chat_with_ai(chat_message: ChatMessage):
     if not model:
         raise HTTPException(status_code=503, detail="Le service de chat IA est désactivé.")
 
-    if session_id not in chat_sessions:
-        chat_sessions[session_id] = model.start_chat(history=[
-            {"role": "user", "parts": ["Tu es FinAnalyse AI, un assistant conversationnel spécialisé en finance pour les débutants. Sois amical, pédagogique et explique les concepts simplement. Ne donne jamais de conseil d'investissement direct, mais aide les utilisateurs à comprendre les données."]},
-            {"role": "model", "parts": ["Bonjour ! Je suis FinAnalyse AI. Comment puis-je vous aider à mieux comprendre la finance aujourd'hui ?"]}
-        ])
+    chat_session = get_chat_session(session_id, [
+        {"role": "user", "parts": ["Tu es FinAnalyse AI, un assistant conversationnel spécialisé en finance pour les débutants. Sois amical, pédagogique et explique les concepts simplement. Ne donne jamais de conseil d'investissement direct, mais aide les utilisateurs à comprendre les données."]},
+        {"role": "model", "parts": ["Bonjour ! Je suis FinAnalyse AI. Comment puis-je vous aider à mieux comprendre la finance aujourd'hui ?"]}
+    ])
 
     try:
-        response = chat_sessions[session_id].send_message(user_message)
+        response = chat_session.send_message(user_message, request_options={"timeout": upstream_timeout(30)})
+        save_chat_session(session_id, chat_session)
         return {"response": response.text}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur de communication avec l'IA: {e}")
@@ -518,7 +662,12 @@ def chat_with_ai(chat_message: ChatMessage):
 def generate_ai_analysis_comment(data: dict) -> str:
     """
     Utilise l'IA Gemini pour générer un commentaire d'analyse financière.
+    Les commentaires réussis sont mis en cache par symbole.
     """
+    cache_key = str(data.get('symbol') or data.get('name', 'N/A')).upper()
+    cached_comment = cache.get("ai_comment", cache_key)
+    if cached_comment is not None:
+        return cached_comment
     try:
         # On prépare un "prompt" clair et détaillé pour l'IA
         prompt = f"""
@@ -536,7 +685,8 @@ def generate_ai_analysis_comment(data: dict) -> str:
         Ne donne pas de conseil d'investissement.
         """
         
-        response = model.generate_content(prompt)
+        response = model.generate_content(prompt, request_options={"timeout": upstream_timeout(30)})
+        cache.set("ai_comment", cache_key, response.text, CACHE_TTL["ai_comment"])
         return response.text
     except Exception as e:
         print(f"Erreur lors de la génération par l'IA: {e}")
@@ -547,30 +697,11 @@ def generate_ai_analysis_comment(data: dict) -> str:
 
 
 
-# --- DONNÉES SIMULÉES POUR LES ACTUALITÉS ---
-MOCK_NEWS = {
-    "moneywise": [
-        {"title": "Inflation Reduction Act: Are You Missing Out on These Major Savings?", "snippet": "The landmark legislation could save you thousands. Are you taking advantage?", "url": "#", "source": "Moneywise"},
-        {"title": "Suze Orman Warns of a Major Financial 'Earthquake' — Here's How to Prepare", "snippet": "The personal finance guru is sounding the alarm. Here are three ways to protect yourself.", "url": "#", "source": "Moneywise"},
-    ],
-    "gobankingrates": [
-        {"title": "5 High-Paying Jobs That Don’t Require a Bachelor’s Degree", "snippet": "You don't need a four-year degree to land a lucrative career. Check out these options.", "url": "#", "source": "GOBankingRates"},
-        {"title": "How To Build Generational Wealth With Just a Few Hundred Dollars", "snippet": "Think you need a fortune to start? Think again. Small, consistent investments can lead to big results.", "url": "#", "source": "GOBankingRates"},
-    ],
-    "morningstar": [
-        {"title": "3 Undervalued Stocks to Buy Now", "snippet": "Our analysts have identified three companies trading below their intrinsic value.", "url": "#", "source": "Morningstar Research"},
-        {"title": "Market Outlook 2025: Navigating a Shifting Landscape", "snippet": "Experts weigh in on what to expect from the markets in the coming year.", "url": "#", "source": "Morningstar Research"},
-    ],
-    "barchart": [
-        {"title": "Corn Prices Surge on Weather Concerns", "snippet": "Futures for corn are up as unfavorable weather patterns threaten crop yields.", "url": "#", "source": "Barchart"},
-        {"title": "Analyst Upgrade: Is This Tech Giant a 'Strong Buy'?", "snippet": "Barchart's technical analysis points to a strong upward trend for this well-known stock.", "url": "#", "source": "Barchart"},
-    ]
-}
 def get_stock_data(ticker: str):
     """Fonction utilitaire pour récupérer l'objet Ticker et gérer les erreurs de base."""
     stock = yf.Ticker(ticker.upper())
     # Si l'historique est vide, le ticker est probablement invalide
-    if stock.history(period="1d").empty:
+    if stock.history(period="1d", timeout=upstream_timeout()).empty:
         raise HTTPException(status_code=404, detail=f"Symbole '{ticker}' non trouvé ou sans données.")
     return stock
 
@@ -722,10 +853,8 @@ def stock_screener(sector: str = None, pe_max: float = None, dividend_min: float
 
     return {"results": results}
 
-@app.get("/api/news")
-def get_news(source: str):
-    """Nouveau point d'accès pour les actualités."""
-    if source not in MOCK_NEWS:
-        raise HTTPException(status_code=404, detail="Source not found")
-    return {"articles": MOCK_NEWS[source]}
+@app.get("/api/analytics/pool")
+def get_analytics_pool_stats():
+    """Utilisation du pool de processus dédié aux calculs lourds."""
+    return analytics_pool.stats()
 
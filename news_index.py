@@ -0,0 +1,282 @@
+# news_index.py - INGESTION INCRÉMENTALE DES ACTUALITÉS ET INDEX LOCAL (SQLite FTS5)
+import os
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from admission import DeadlineExceeded, RequestCancelled, upstream_timeout
+from cache_store import CACHE_DB_PATH, close_thread_connection, thread_connection
+
+# --- CONFIGURATION ---
+NEWS_POLL_INTERVAL = float(os.getenv('NEWS_POLL_INTERVAL', 120))
+NEWS_RETENTION_DAYS = int(os.getenv('NEWS_RETENTION_DAYS', 30))
+NEWS_MAX_PAGES = int(os.getenv('NEWS_MAX_PAGES', 5))
+# Fenêtre récupérée lors du tout premier remplissage de l'index
+NEWS_BACKFILL_HOURS = int(os.getenv('NEWS_BACKFILL_HOURS', 24))
+NEWS_PAGE_SIZE = 50
+MARKETAUX_URL = "https://api.marketaux.com/v1/news/all"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS news_articles (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL UNIQUE,
+    url TEXT UNIQUE,
+    source TEXT,
+    published_at TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    snippet TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS news_published ON news_articles (published_at DESC);
+CREATE INDEX IF NOT EXISTS news_source ON news_articles (source, published_at DESC);
+CREATE TABLE IF NOT EXISTS news_entities (
+    symbol TEXT NOT NULL,
+    article_id INTEGER NOT NULL,
+    PRIMARY KEY (symbol, article_id)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(
+    title, description, snippet, content='news_articles', content_rowid='id'
+);
+CREATE TABLE IF NOT EXISTS news_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+INSERT OR IGNORE INTO news_state (key, value) VALUES ('cursor', ''), ('poll_lease', '0');
+"""
+
+
+def _fts_query(keywords: str) -> str:
+    # Chaque mot est mis entre guillemets : la syntaxe FTS5 ne doit pas être interprétée
+    return " ".join('"' + word.replace('"', '""') + '"' for word in keywords.split())
+
+
+class NewsIndex:
+    """Stocke les articles Marketaux une seule fois et les indexe par entité, source et texte."""
+
+    def __init__(self, api_key: str, path: str = CACHE_DB_PATH, poll_interval: float = NEWS_POLL_INTERVAL):
+        self.api_key = api_key
+        self.path = path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+        self._fill_lock = threading.Lock()
+        self._fill_attempted = False
+        self._stats = {"polls": 0, "fetched": 0, "inserted": 0, "duplicates": 0, "lastPollAt": None, "lastError": None}
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path)
+
+    # --- INGESTION ---
+    def _claim_poll(self) -> bool:
+        """Un seul worker interroge Marketaux par intervalle : le bail est pris atomiquement en base."""
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE news_state SET value = ? WHERE key = 'poll_lease' AND CAST(value AS REAL) <= ?",
+            (str(now), now - self.poll_interval),
+        )
+        return cursor.rowcount == 1
+
+    def _fetch_page(self, published_after: str, page: int) -> dict:
+        params = {
+            "countries": "us,fr",
+            "filter_entities": "true",
+            "language": "en",
+            "limit": NEWS_PAGE_SIZE,
+            "page": page,
+            # Du plus ancien au plus récent : le curseur peut avancer après chaque page sans
+            # dépasser d'articles pas encore récupérés
+            "sort": "published_on",
+            "sort_order": "asc",
+            "published_after": published_after,
+            "api_token": self.api_key,
+        }
+        response = requests.get(MARKETAUX_URL, params=params, timeout=upstream_timeout())
+        response.raise_for_status()
+        return response.json()
+
+    def store(self, articles: list) -> int:
+        """Insère les articles inconnus (dédupliqués par uuid et par URL) et met à jour le curseur.
+
+        Les pages arrivent du plus ancien au plus récent, donc tout article non encore récupéré
+        est postérieur au nouveau curseur.
+        """
+        conn = self._connection()
+        inserted = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for article in articles:
+                if not article.get("uuid") or not article.get("published_at"):
+                    continue
+                source = (article.get("source") or "").lower()
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO news_articles (uuid, url, source, published_at, title, description, snippet, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (article["uuid"], article.get("url"), source, article["published_at"], article.get("title"),
+                     article.get("description"), article.get("snippet"), json.dumps(article)),
+                )
+                if cursor.rowcount != 1:
+                    continue
+                article_id = cursor.lastrowid
+                inserted += 1
+                conn.execute(
+                    "INSERT INTO news_fts (rowid, title, description, snippet) VALUES (?, ?, ?, ?)",
+                    (article_id, article.get("title"), article.get("description"), article.get("snippet")),
+                )
+                symbols = {entity.get("symbol", "").upper() for entity in article.get("entities") or []}
+                conn.executemany(
+                    "INSERT OR IGNORE INTO news_entities (symbol, article_id) VALUES (?, ?)",
+                    [(symbol, article_id) for symbol in symbols if symbol],
+                )
+            conn.execute(
+                "UPDATE news_state SET value = (SELECT COALESCE(MAX(published_at), '') FROM news_articles) WHERE key = 'cursor'"
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._stats["fetched"] += len(articles)
+        self._stats["inserted"] += inserted
+        self._stats["duplicates"] += len(articles) - inserted
+        return inserted
+
+    def ingest(self, force: bool = False) -> int:
+        """Récupère uniquement les articles publiés après le curseur. Renvoie le nombre d'articles ajoutés."""
+        if not self.api_key or not (force or self._claim_poll()):
+            return 0
+        cursor = self._connection().execute("SELECT value FROM news_state WHERE key = 'cursor'").fetchone()[0]
+        # Marketaux attend le format AAAA-MM-JJTHH:MM:SS
+        published_after = cursor[:19] or (
+            datetime.now(timezone.utc) - timedelta(hours=NEWS_BACKFILL_HOURS)
+        ).strftime("%Y-%m-%dT%H:%M:%S")
+        inserted = 0
+        try:
+            for page in range(1, NEWS_MAX_PAGES + 1):
+                data = self._fetch_page(published_after, page)
+                articles = data.get("data", [])
+                inserted += self.store(articles)
+                if len(articles) < data.get("meta", {}).get("limit", NEWS_PAGE_SIZE):
+                    break
+            self._stats["lastError"] = None
+        except (DeadlineExceeded, RequestCancelled):
+            # Appel depuis une requête dont l'échéance est atteinte : on garde les pages déjà
+            # stockées, la tâche de fond reprendra depuis le curseur
+            pass
+        except requests.exceptions.RequestException as e:
+            print(f"Erreur API Marketaux: {e}")
+            self._stats["lastError"] = str(e)
+        self._stats["polls"] += 1
+        self._stats["lastPollAt"] = datetime.now(timezone.utc).isoformat()
+        return inserted
+
+    def fill_once(self):
+        """Premier remplissage synchrone d'un index vide, tenté une seule fois par processus.
+
+        Les requêtes suivantes ne relancent pas d'appels Marketaux : la tâche de fond prend le relais.
+        """
+        with self._fill_lock:
+            if self._fill_attempted:
+                return
+            self._fill_attempted = True
+            if self.is_empty():
+                self.ingest(force=True)
+
+    @property
+    def last_error(self):
+        return self._stats["lastError"]
+
+    def prune(self, retention_days: int = NEWS_RETENTION_DAYS):
+        limit = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%dT%H:%M:%S")
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO news_fts (news_fts, rowid, title, description, snippet) "
+                "SELECT 'delete', id, title, description, snippet FROM news_articles WHERE published_at < ?",
+                (limit,),
+            )
+            conn.execute(
+                "DELETE FROM news_entities WHERE article_id IN (SELECT id FROM news_articles WHERE published_at < ?)",
+                (limit,),
+            )
+            conn.execute("DELETE FROM news_articles WHERE published_at < ?", (limit,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- TÂCHE DE FOND ---
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.ingest():
+                    self.prune()
+            except Exception as e:
+                print(f"Erreur lors de l'ingestion des actualités: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        if self.api_key and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="news-ingestion", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # --- RECHERCHE ---
+    def search(self, ticker: str = None, source: str = None, keywords: str = None,
+               published_after: str = None, page: int = 1, limit: int = 15) -> dict:
+        """Filtre les articles indexés et renvoie la page demandée, du plus récent au plus ancien."""
+        joins, conditions, params = [], [], []
+        if ticker:
+            joins.append("JOIN news_entities e ON e.article_id = a.id AND e.symbol = ?")
+            params.append(ticker.upper())
+        if source:
+            conditions.append("a.source = ?")
+            params.append(source.lower())
+        if keywords and keywords.split():
+            conditions.append("a.id IN (SELECT rowid FROM news_fts WHERE news_fts MATCH ?)")
+            params.append(_fts_query(keywords))
+        if published_after:
+            conditions.append("a.published_at > ?")
+            params.append(published_after)
+
+        query = "FROM news_articles a " + " ".join(joins)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        conn = self._connection()
+        total = conn.execute(f"SELECT COUNT(*) {query}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT a.data {query} ORDER BY a.published_at DESC LIMIT ? OFFSET ?",
+            params + [limit, (page - 1) * limit],
+        ).fetchall()
+        return {
+            "articles": [json.loads(row[0]) for row in rows],
+            "page": page,
+            "limit": limit,
+            "total": total,
+        }
+
+    def is_empty(self) -> bool:
+        return self._connection().execute("SELECT NOT EXISTS (SELECT 1 FROM news_articles)").fetchone()[0] == 1
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["articles"] = self._connection().execute("SELECT COUNT(*) FROM news_articles").fetchone()[0]
+        stats["cursor"] = self._connection().execute("SELECT value FROM news_state WHERE key = 'cursor'").fetchone()[0]
+        return stats
+
+    def close(self):
+        self.stop()
+        close_thread_connection(self._local)